@@ -3,12 +3,18 @@
 import sys
 import os
 import io
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from operator import itemgetter
 from pathlib import Path
+from typing import Iterable
 
-# Set UTF-8 encoding for Windows Unicode support
+# Set UTF-8 encoding for Windows Unicode support (skipped when the console is already UTF-8)
 if sys.platform == "win32":
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    if not (sys.stdout.encoding or "").lower().startswith("utf"):
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+    if not (sys.stderr.encoding or "").lower().startswith("utf"):
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True)
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
 try:
@@ -18,46 +24,68 @@ except ImportError:
     pass
 
 from src.database import Database
-from src.parser import CIBCParser
 from src.categorizer import Categorizer
 
 
+# Number of parsed transactions categorized and inserted per executemany
+INSERT_CHUNK_SIZE = 500
+
+# Number of per-transaction progress lines written to stdout at once
+PRINT_BATCH_SIZE = 500
+
+
+def _extract(pdf_path: str):
+    """Parse a PDF into (account_info, transactions). Runs in worker processes."""
+    from src.parser import CIBCParser
+    
+    parser = CIBCParser(pdf_path)
+    try:
+        return parser.extract_account_info(), list(parser.parse_transactions())
+    finally:
+        parser.close()
+
+def _store_statement(account_info: dict, transactions: Iterable[dict], db: Database, categorizer: Categorizer):
+    """Insert a statement's transactions into the database, one chunk at a time."""
+    # The whole statement is written as a single SQLite transaction
+    with db.bulk():
+        account_id = db.add_account(
+            account_info['account_number'],
+            account_info['account_name'],
+            account_info['account_type']
+        )
+        print(f"✓ Account: {account_info['account_number']} ({account_info['account_type']})")
+        
+        # Add to database with categorization, flushing every INSERT_CHUNK_SIZE rows
+        found_count = 0
+        new_count = 0
+        transactions = iter(transactions)
+        while True:
+            chunk = list(islice(transactions, INSERT_CHUNK_SIZE))
+            if not chunk:
+                break
+            category_ids = categorizer.categorize_batch([tx['description'] for tx in chunk])
+            rows = [
+                (account_id, tx['date'], tx['description'], tx['amount'], tx.get('balance'), category_id)
+                for tx, category_id in zip(chunk, category_ids)
+            ]
+            new_count += db.add_transactions_bulk(rows)
+            found_count += len(chunk)
+    
+    print(f"✓ Found {found_count} transactions")
+    print(f"✓ Added {new_count} new transactions ({found_count - new_count} duplicates skipped)")
+
 def parse_pdf(pdf_path: str, db: Database, categorizer: Categorizer):
     """Parse a single PDF statement."""
     print(f"📄 Parsing {pdf_path}...")
     
-    parser = CIBCParser(pdf_path)
-    
-    # Extract account info
-    account_info = parser.extract_account_info()
-    account_id = db.add_account(
-        account_info['account_number'],
-        account_info['account_name'],
-        account_info['account_type']
-    )
-    print(f"✓ Account: {account_info['account_number']} ({account_info['account_type']})")
-    
-    # Parse transactions
-    transactions = parser.parse_transactions()
-    print(f"✓ Found {len(transactions)} transactions")
+    # Imported here so commands that don't parse PDFs skip loading the PDF backend
+    from src.parser import CIBCParser
     
-    # Add to database with categorization
-    new_count = 0
-    for tx in transactions:
-        category_id = categorizer.categorize(tx['description'])
-        tx_id = db.add_transaction(
-            account_id=account_id,
-            date=tx['date'],
-            description=tx['description'],
-            amount=tx['amount'],
-            balance=tx.get('balance'),
-            category_id=category_id
-        )
-        if tx_id:
-            new_count += 1
-    
-    print(f"✓ Added {new_count} new transactions ({len(transactions) - new_count} duplicates skipped)")
-    parser.close()
+    parser = CIBCParser(pdf_path)
+    try:
+        _store_statement(parser.extract_account_info(), parser.parse_transactions(), db, categorizer)
+    finally:
+        parser.close()
 
 def parse_all(db: Database, categorizer: Categorizer):
     """Parse all PDFs in Statements directory."""
@@ -67,7 +95,7 @@ def parse_all(db: Database, categorizer: Categorizer):
         print("❌ Statements/ directory not found")
         return
     
-    pdf_files = list(statements_dir.glob("*.pdf"))
+    pdf_files = [str(p) for p in statements_dir.glob("*.pdf")]
     
     if not pdf_files:
         print("❌ No PDF files found in Statements/")
@@ -75,9 +103,15 @@ def parse_all(db: Database, categorizer: Categorizer):
     
     print(f"📁 Found {len(pdf_files)} statement(s)\n")
     
-    for pdf_file in pdf_files:
-        parse_pdf(str(pdf_file), db, categorizer)
-        print()
+    # PDF text extraction is CPU-bound, so parse files in parallel and keep
+    # SQLite writes on this process. Threads wouldn't help: extraction holds
+    # the GIL and a document's pages share one parser. One worker per file at most.
+    workers = min(len(pdf_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for pdf_file, (account_info, transactions) in zip(pdf_files, executor.map(_extract, pdf_files)):
+            print(f"📄 Parsing {pdf_file}...")
+            _store_statement(account_info, transactions, db, categorizer)
+            print()
 
 def sync_to_sheets(db: Database):
     """Sync database to Google Sheets."""
@@ -105,20 +139,67 @@ def sync_to_sheets(db: Database):
     try:
         sheets = SheetsClient(credentials_file, spreadsheet_id)
         accounts = db.get_accounts()
+        # Sync state is kept per sheet, so renaming an account starts its new sheet afresh
+        account_sheets = {
+            account['id']: SheetsClient.sheet_name_for(account['account_number'], account.get('account_name'))
+            for account in accounts
+        }
         
-        for account in accounts:
-            account_name = account.get('account_name')
-            display_name = account_name if account_name else account['account_number']
-            print(f"📋 Syncing account: {display_name}")
-            transactions = db.get_transactions(account_id=account['id'])
+        pending = accounts
+        backfilling = False
+        while pending:
+            # One query for every account, split up per account here. Transactions the
+            # sheets are already up to date on are filtered out by SQLite
+            all_transactions = db.get_transactions(order_by="account", unsynced_for=spreadsheet_id,
+                                                   sheets=account_sheets)
+            by_account = {
+                account_id: list(rows)
+                for account_id, rows in groupby(all_transactions, key=itemgetter('account_id'))
+            }
+            
+            jobs = []
+            for account in pending:
+                account_name = account.get('account_name')
+                display_name = account_name if account_name else account['account_number']
+                transactions = by_account.get(account['id'], [])
+                
+                if backfilling:
+                    if transactions:
+                        print(f"📋 Backfilling recreated sheet: {display_name}")
+                else:
+                    print(f"📋 Syncing account: {display_name}")
+                    if not transactions:
+                        print("   ✓ Already up to date")
+                if not transactions:
+                    continue
+                
+                # Debug: Show category info for first few transactions
+                print(f"   Found {len(transactions)} transactions to sync")
+                if transactions:
+                    sample_tx = transactions[0]
+                    print(f"   Sample transaction categories: parent='{sample_tx.get('parent_category', 'None')}', category='{sample_tx.get('category', 'None')}'")
+                
+                jobs.append((transactions, account['account_number'], account_name))
             
-            # Debug: Show category info for first few transactions
-            print(f"   Found {len(transactions)} transactions")
-            if transactions:
-                sample_tx = transactions[0]
-                print(f"   Sample transaction categories: parent='{sample_tx.get('parent_category', 'None')}', category='{sample_tx.get('category', 'None')}'")
+            if not jobs:
+                break
             
-            sheets.sync_transactions(transactions, account['account_number'], account_name)
+            # Every account's sheet writes go out together
+            print()
+            synced_ids, created_sheets = sheets.sync_many(jobs)
+            synced_ids = set(synced_ids)
+            
+            # A sheet created by this sync (e.g. one deleted by hand) holds only what
+            # was just written; forget what was recorded for it so the rest is backfilled
+            pending = [account for account in pending if account_sheets[account['id']] in created_sheets]
+            db.clear_synced(spreadsheet_id, {account_sheets[account['id']] for account in pending})
+            
+            # Only what actually reached the sheets; failed writes are retried next sync
+            db.mark_synced(spreadsheet_id, (
+                (account_sheets[tx['account_id']], tx)
+                for transactions, _, _ in jobs for tx in transactions if tx['id'] in synced_ids
+            ))
+            backfilling = True
         
         print("\n✓ Sync complete!")
         
@@ -199,10 +280,7 @@ def recategorize_all(db: Database, categorizer: Categorizer):
     """Recategorize all uncategorized transactions."""
     print("🔄 Recategorizing all transactions...")
     
-    # Get all uncategorized transactions
-    cursor = db.conn.cursor()
-    cursor.execute("SELECT id, description FROM transactions WHERE category_id IS NULL")
-    uncategorized = cursor.fetchall()
+    uncategorized = db.get_uncategorized()
     
     if not uncategorized:
         print("✓ All transactions are already categorized!")
@@ -210,16 +288,23 @@ def recategorize_all(db: Database, categorizer: Categorizer):
     
     print(f"Found {len(uncategorized)} uncategorized transactions")
     
-    updated_count = 0
-    for tx_id, description in uncategorized:
-        category_id = categorizer.categorize(description)
+    # Match every description in one pass, then write all the matches in one transaction
+    category_ids = categorizer.categorize_batch([description for _, description in uncategorized])
+    assignments = []
+    updated = []
+    for (tx_id, description), category_id in zip(uncategorized, category_ids):
         if category_id:
-            cursor.execute("UPDATE transactions SET category_id = ? WHERE id = ?", (category_id, tx_id))
-            updated_count += 1
-            print(f"✓ Categorized: {description[:50]}...")
+            assignments.append((category_id, tx_id))
+            updated.append(description)
+    db.set_categories(assignments)
+    
+    # Write progress lines in batches rather than one print() per row
+    for start in range(0, len(updated), PRINT_BATCH_SIZE):
+        batch = updated[start:start + PRINT_BATCH_SIZE]
+        sys.stdout.write("".join(f"✓ Categorized: {description[:50]}...\n" for description in batch))
+    sys.stdout.flush()
     
-    db.conn.commit()
-    print(f"✓ Updated {updated_count} transactions with categories")
+    print(f"✓ Updated {len(updated)} transactions with categories")
 
 def debug_categories(db: Database, categorizer: Categorizer):
     """Debug category information."""
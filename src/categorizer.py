@@ -1,8 +1,16 @@
 """Transaction categorization engine."""
 import json
+import re
+from itertools import groupby
+from operator import itemgetter
 from typing import Optional, List, Dict, Any
 from src.database import Database
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 
 class Categorizer:
     def __init__(self, db: Database):
@@ -12,47 +20,135 @@ class Categorizer:
     def _load_categories(self):
         """Load categories from database into memory."""
         self.categories = self.db.get_categories()
+        self._by_id = {c['id']: c for c in self.categories}
+        self._root_by_name = {}
+        for c in self.categories:
+            if c['parent_id'] is None:
+                self._root_by_name.setdefault(c['name'], c)
+        
+        # Keywords come back from SQLite already split out of their JSON lists
+        self._compiled = [
+            (category_id, [keyword.lower() for _, keyword in rows])
+            for category_id, rows in groupby(self.db.get_category_keywords(), key=itemgetter(0))
+        ]
+        # Keywords shared by several categories (e.g. "starbucks") are only
+        # kept for the first one, which is the one the scan would return anyway
+        self._kw_to_cat = {}
+        for category_id, keywords in self._compiled:
+            for keyword in keywords:
+                if keyword:
+                    self._kw_to_cat.setdefault(keyword, category_id)
+        # First character of every keyword: a description sharing none of them can't match
+        self._first_chars = {keyword[0] for keyword in self._kw_to_cat}
+        self._build_matcher()
+    
+    def _build_matcher(self):
+        """Compile all category keywords into a single matcher.
+        
+        A keyword's rank is its position in _kw_to_cat (category order, then
+        keyword order), so the first keyword the old linear scan would have
+        hit still wins.
+        """
+        self._keywords = list(self._kw_to_cat)
+        
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for rank, keyword in enumerate(self._keywords):
+                self._automaton.add_word(keyword, rank)
+            if self._keywords:
+                self._automaton.make_automaton()
+            self._pattern = None
+        else:
+            # Fallback: one group per keyword, wrapped in a lookahead so overlapping matches are seen
+            self._automaton = None
+            self._pattern = re.compile(
+                "(?=" + "|".join(f"({re.escape(k)})" for k in self._keywords) + ")"
+            ) if self._keywords else None
+    
+    def _match(self, description_lower: str) -> Optional[str]:
+        """Return the best-ranked keyword found in the description."""
+        best = None
+        if self._automaton is not None:
+            if not self._keywords:
+                return None
+            for _, rank in self._automaton.iter(description_lower):
+                if best is None or rank < best:
+                    best = rank
+        elif self._pattern is not None:
+            for match in self._pattern.finditer(description_lower):
+                rank = match.lastindex - 1
+                if best is None or rank < best:
+                    best = rank
+        return self._keywords[best] if best is not None else None
     
     def categorize(self, description: str, debug: bool = False) -> Optional[int]:
         """Find matching category for transaction description."""
-        description_lower = description.lower()
+        if not debug:
+            return self.categorize_lower(description.lower())
         
-        if debug:
-            print(f"  Categorizing: {description}")
+        print(f"  Categorizing: {description}")
         
-        # Try to match keywords
-        for category in self.categories:
-            if not category['keywords']:
-                continue
-            
-            keywords = json.loads(category['keywords'])
-            for keyword in keywords:
-                if keyword.lower() in description_lower:
-                    if debug:
-                        print(f"    -> Matched '{keyword}' to {category['name']}")
-                    return category['id']
+        keyword = self._match(description.lower()) if description else None
+        if keyword is not None:
+            category_id = self._kw_to_cat[keyword]
+            print(f"    -> Matched '{keyword}' to {self._by_id[category_id]['name']}")
+            return category_id
         
-        if debug:
-            print(f"    -> No match found")
+        print(f"    -> No match found")
         return None  # Uncategorized
     
+    def categorize_lower(self, description_lower: str) -> Optional[int]:
+        """Like categorize(), for a description the caller has already lowercased."""
+        if not description_lower or self._first_chars.isdisjoint(description_lower):
+            return None
+        
+        keyword = self._match(description_lower)
+        return self._kw_to_cat[keyword] if keyword is not None else None
+    
+    def categorize_batch(self, descriptions: List[str]) -> List[Optional[int]]:
+        """Categorize many descriptions at once; repeated descriptions are matched only once."""
+        results = {}
+        category_ids = []
+        for description in descriptions:
+            if description not in results:
+                results[description] = self.categorize_lower(description.lower())
+            category_ids.append(results[description])
+        return category_ids
+    
     def add_category_with_keywords(self, name: str, keywords: List[str], parent_name: Optional[str] = None) -> int:
         """Add a new category with keywords."""
+        category_id = self._add_category_no_reload(name, keywords, parent_name)
+        self._load_categories()  # Reload
+        return category_id
+    
+    def _add_category_no_reload(self, name: str, keywords: Optional[List[str]], parent_name: Optional[str] = None) -> int:
+        """Insert a category and record it in self.categories without reloading from the database.
+        
+        The keyword matcher is left stale; callers must run _load_categories() when done.
+        """
         parent_id = None
         
         if parent_name:
-            # Find parent category
-            for cat in self.categories:
-                if cat['name'] == parent_name and cat['parent_id'] is None:
-                    parent_id = cat['id']
-                    break
+            parent = self._root_by_name.get(parent_name)
             
             # Create parent if doesn't exist
-            if parent_id is None:
-                parent_id = self.db.add_category(parent_name)
+            if parent is None:
+                parent_id = self._add_category_no_reload(parent_name, None)
+            else:
+                parent_id = parent['id']
         
         category_id = self.db.add_category(name, parent_id, keywords)
-        self._load_categories()  # Reload
+        if category_id not in self._by_id:
+            category = {
+                'id': category_id,
+                'name': name,
+                'parent_id': parent_id,
+                'keywords': json.dumps(keywords, separators=(',', ':')) if keywords else None  # as stored
+            }
+            self.categories.append(category)
+            self._by_id[category_id] = category
+            if parent_id is None:
+                self._root_by_name.setdefault(name, category)
         return category_id
     
     def initialize_default_categories(self):
@@ -97,24 +193,19 @@ class Categorizer:
         
         for parent_name, subcategories in default_categories.items():
             for subcat_name, keywords in subcategories.items():
-                self.add_category_with_keywords(subcat_name, keywords, parent_name)
+                self._add_category_no_reload(subcat_name, keywords, parent_name)
+        
+        self._load_categories()
     
     def get_category_tree(self) -> Dict[str, List[str]]:
         """Get categories organized by parent."""
-        tree = {}
-        
-        for cat in self.categories:
-            if cat['parent_id'] is None:
-                tree[cat['name']] = []
+        tree = {cat['name']: [] for cat in self.categories if cat['parent_id'] is None}
         
         for cat in self.categories:
             if cat['parent_id'] is not None:
-                # Find parent name
-                parent = next((c for c in self.categories if c['id'] == cat['parent_id']), None)
+                parent = self._by_id.get(cat['parent_id'])
                 if parent:
-                    if parent['name'] not in tree:
-                        tree[parent['name']] = []
-                    tree[parent['name']].append(cat['name'])
+                    tree.setdefault(parent['name'], []).append(cat['name'])
         
         return tree
 
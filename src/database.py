@@ -2,16 +2,160 @@
 import sqlite3
 import hashlib
 import json
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+# Hot-path SQL kept as constant strings so sqlite3's statement cache is hit on every call
+# Duplicates (same hash) are skipped by SQLite rather than raised as IntegrityError
+_INSERT_TX_SQL = """
+    INSERT OR IGNORE INTO transactions (account_id, date, description, amount, balance, category_id, hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+# The no-op DO UPDATE makes RETURNING give back the existing row's id on a conflict
+_UPSERT_ACCOUNT_SQL = """
+    INSERT INTO accounts (account_number, account_name, account_type) VALUES (?, ?, ?)
+    ON CONFLICT (account_number) DO UPDATE SET account_number = account_number
+    RETURNING id
+"""
+_UPSERT_CATEGORY_SQL = """
+    INSERT INTO categories (name, parent_id, keywords) VALUES (?, ?, ?)
+    ON CONFLICT (name, parent_id) DO UPDATE SET name = name
+    RETURNING id
+"""
+
+# Transactions already written to each sheet of each Google spreadsheet, and whether
+# they had a category then; lets sync skip rows the sheet is known to be up to date on
+_SYNCED_TRANSACTIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS synced_transactions (
+        spreadsheet_id TEXT NOT NULL,
+        sheet TEXT NOT NULL,
+        transaction_id INTEGER NOT NULL,
+        categorized INTEGER NOT NULL,
+        PRIMARY KEY (spreadsheet_id, sheet, transaction_id),
+        FOREIGN KEY (transaction_id) REFERENCES transactions(id)
+    )
+"""
+
+# ORDER BY clauses get_transactions() accepts, by name; callers never pass raw SQL
+TRANSACTION_ORDERINGS = {
+    "date": "t.date DESC",
+    "account": "t.account_id, t.date DESC",
+}
+
+# Bumped whenever existing rows need migrating; stored in PRAGMA user_version
+SCHEMA_VERSION = 4
+
+# Read-only connections kept alongside the writer; WAL lets them read while it writes
+READ_POOL_SIZE = 4
+
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+
+
+def _tx_hash(account_id: int, date: str, description: str, amount: float) -> str:
+    """Hash used to detect duplicate transactions."""
+    # Hash the amount as SQLite stores it: a REAL, with -0.0 folded into 0.0 (the
+    # bank parser yields -0.0 for a 0.00 withdrawal)
+    hash_str = f"{account_id}|{date}|{description}|{amount + 0.0}"
+    return hashlib.blake2b(hash_str.encode(), digest_size=12).hexdigest()
+
+
+def _fetch_dicts(conn: sqlite3.Connection, query: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+    """Run a query and return its rows as dicts, built straight from the raw tuples.
+    
+    Skips creating an sqlite3.Row per row only to copy it into a dict.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
 
 
 class Database:
     def __init__(self, db_path: str = "fintrack.db"):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        # Autocommit mode: transactions are only opened explicitly, by bulk()
+        self.conn = sqlite3.connect(
+            db_path, isolation_level=None, check_same_thread=False, cached_statements=CACHED_STATEMENTS
+        )
         self.conn.row_factory = sqlite3.Row
+        # Single-row writes share one cursor instead of allocating one per call
+        self._write_cursor = self.conn.cursor()
+        self._in_bulk = False
+        self._bulk_thread = None
+        # Reader connections are opened on demand, up to READ_POOL_SIZE
+        self._read_pool = queue.Queue()
+        self._readers_opened = 0
+        self._read_lock = threading.Lock()
+        self._configure_pragmas()
         self._create_tables()
+        self._migrate()
+    
+    def _configure_pragmas(self):
+        """Tune the connection for a local single-writer workload."""
+        self.conn.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, no fsync per commit
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self._configure_read_pragmas(self.conn)
+    
+    @staticmethod
+    def _configure_read_pragmas(conn: sqlite3.Connection):
+        """Per-connection tuning shared by the writer and the readers."""
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    
+    def _open_reader(self) -> sqlite3.Connection:
+        """Open a read-only connection to the database file."""
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, isolation_level=None, check_same_thread=False, cached_statements=CACHED_STATEMENTS
+        )
+        conn.row_factory = sqlite3.Row
+        self._configure_read_pragmas(conn)
+        return conn
+    
+    @contextmanager
+    def _read(self):
+        """Borrow a reader connection from the pool.
+        
+        Inside bulk() the writer is used instead, so reads from the thread
+        running the block see its uncommitted rows; an in-memory database
+        has no file to share.
+        """
+        in_own_bulk = self._in_bulk and self._bulk_thread == threading.get_ident()
+        if in_own_bulk or self.db_path == ":memory:":
+            yield self.conn
+            return
+        
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._read_lock:
+                can_open = self._readers_opened < READ_POOL_SIZE
+                if can_open:
+                    self._readers_opened += 1
+            if not can_open:
+                conn = self._read_pool.get()
+            else:
+                try:
+                    conn = self._open_reader()
+                except BaseException:
+                    # Give the slot back, or enough failures would leave reads waiting forever
+                    with self._read_lock:
+                        self._readers_opened -= 1
+                    raise
+        
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
     
     def _create_tables(self):
         """Create database schema."""
@@ -58,75 +202,156 @@ class Database:
             )
         """)
         
+        cursor.execute(_SYNCED_TRANSACTIONS_SQL)
+        
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(account_id)")
+        # Serves per-account lookups and the account/date ordering without a sort step;
+        # supersedes the old single-column account index
+        cursor.execute("DROP INDEX IF EXISTS idx_transactions_account")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions(account_id, date DESC, id)"
+        )
+        # Partial index: uncategorized counts and recategorize only touch these rows
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transactions_uncategorized ON transactions(account_id) WHERE category_id IS NULL"
+        )
         
         self.conn.commit()
     
+    @contextmanager
+    def bulk(self):
+        """Run a block of writes as one SQLite transaction.
+        
+        Methods called inside the block skip their own commits; everything is
+        committed once on exit, or rolled back if the block raises.
+        """
+        if self._in_bulk:
+            yield self
+            return
+        
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._in_bulk = True
+        self._bulk_thread = threading.get_ident()
+        try:
+            yield self
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self._in_bulk = False
+            self._bulk_thread = None
+    
+    def _commit(self):
+        """Commit unless a bulk() block will commit for us (a no-op in autocommit mode)."""
+        if not self._in_bulk:
+            self.conn.commit()
+    
+    def _migrate(self):
+        """Bring rows written by older versions up to SCHEMA_VERSION."""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        with self.bulk():
+            if version < 3:
+                # Transaction hashes moved from MD5 to 12-byte BLAKE2b (1), then to
+                # hashing normalized amounts (3); recompute them so re-importing an old
+                # statement is still detected as a duplicate. A row that now collides
+                # was already a duplicate of another and keeps its old hash
+                self.conn.create_function("tx_hash", 4, _tx_hash, deterministic=True)
+                self.conn.execute(
+                    "UPDATE OR IGNORE transactions SET hash = tx_hash(account_id, date, description, amount)"
+                )
+            if version < 4:
+                # Sync state is now kept per spreadsheet (2) and per sheet (4). The old
+                # rows don't say which one they were for; dropping them only costs one
+                # full sync, which the sheets' own dedup keeps from writing duplicates
+                self.conn.execute("DROP TABLE IF EXISTS synced_transactions")
+                self.conn.execute(_SYNCED_TRANSACTIONS_SQL)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
     def add_account(self, account_number: str, account_name: str = None, account_type: str = None) -> int:
         """Add or get account ID."""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO accounts (account_number, account_name, account_type) VALUES (?, ?, ?)",
-            (account_number, account_name, account_type)
-        )
-        self.conn.commit()
-        
-        cursor.execute("SELECT id FROM accounts WHERE account_number = ?", (account_number,))
-        return cursor.fetchone()[0]
+        account_id = self._write_cursor.execute(
+            _UPSERT_ACCOUNT_SQL, (account_number, account_name, account_type)
+        ).fetchone()[0]
+        self._commit()
+        return account_id
     
     def add_category(self, name: str, parent_id: Optional[int] = None, keywords: List[str] = None) -> int:
-        """Add category with optional keywords."""
-        cursor = self.conn.cursor()
-        keywords_json = json.dumps(keywords) if keywords else None
+        """Add category with optional keywords; an existing category's id is returned unchanged."""
+        # Compact JSON: SQLite's json_each reads it for keyword matching
+        keywords_json = json.dumps(keywords, separators=(',', ':')) if keywords else None
         
-        try:
-            cursor.execute(
-                "INSERT INTO categories (name, parent_id, keywords) VALUES (?, ?, ?)",
-                (name, parent_id, keywords_json)
-            )
-            self.conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            # Category already exists
-            cursor.execute(
-                "SELECT id FROM categories WHERE name = ? AND parent_id IS ?",
-                (name, parent_id)
-            )
-            return cursor.fetchone()[0]
+        category_id = self._write_cursor.execute(
+            _UPSERT_CATEGORY_SQL, (name, parent_id, keywords_json)
+        ).fetchone()[0]
+        self._commit()
+        return category_id
     
     def get_categories(self) -> List[Dict[str, Any]]:
         """Get all categories with hierarchy."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id, name, parent_id, keywords FROM categories")
-        return [dict(row) for row in cursor.fetchall()]
+        with self._read() as conn:
+            return _fetch_dicts(conn, "SELECT id, name, parent_id, keywords FROM categories")
+    
+    def get_category_keywords(self) -> List[Tuple[int, str]]:
+        """Get (category_id, keyword) pairs, expanded from the JSON keyword lists by SQLite.
+        
+        Ordered by category id, then keyword position within the category.
+        """
+        with self._read() as conn:
+            cursor = conn.execute("""
+                SELECT c.id, k.value
+                FROM categories c, json_each(c.keywords) k
+                ORDER BY c.id, k.key
+            """)
+            return cursor.fetchall()
     
     def add_transaction(self, account_id: int, date: str, description: str, 
                        amount: float, balance: float = None, category_id: int = None) -> Optional[int]:
         """Add transaction if not duplicate."""
         # Create hash for duplicate detection
-        hash_str = f"{account_id}|{date}|{description}|{amount}"
-        tx_hash = hashlib.md5(hash_str.encode()).hexdigest()
+        tx_hash = _tx_hash(account_id, date, description, amount)
         
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute("""
-                INSERT INTO transactions (account_id, date, description, amount, balance, category_id, hash)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (account_id, date, description, amount, balance, category_id, tx_hash))
-            self.conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            # Duplicate transaction
-            return None
+        cursor = self._write_cursor.execute(
+            _INSERT_TX_SQL, (account_id, date, description, amount, balance, category_id, tx_hash)
+        )
+        self._commit()
+        return cursor.lastrowid if cursor.rowcount else None  # None for a duplicate
     
-    def get_transactions(self, account_id: Optional[int] = None, limit: int = None) -> List[Dict[str, Any]]:
-        """Get transactions with category info."""
-        cursor = self.conn.cursor()
+    def add_transactions_bulk(self, rows: Iterable[Tuple]) -> int:
+        """Insert many transactions in one SQLite transaction, skipping duplicates.
+        
+        Each row is (account_id, date, description, amount, balance, category_id).
+        Returns the number of rows actually inserted.
+        """
+        params = [
+            (account_id, date, description, amount, balance, category_id,
+             _tx_hash(account_id, date, description, amount))
+            for account_id, date, description, amount, balance, category_id in rows
+        ]
+        
+        with self.bulk():
+            cursor = self.conn.executemany(_INSERT_TX_SQL, params)
+        return cursor.rowcount
+    
+    def get_transactions(self, account_id: Optional[int] = None, limit: int = None,
+                         order_by: str = "date", unsynced_for: Optional[str] = None,
+                         sheets: Optional[Dict[int, str]] = None) -> List[Dict[str, Any]]:
+        """Get transactions with category info, sorted by one of TRANSACTION_ORDERINGS.
         
+        "date" is newest first; "account" groups by account, newest first within each.
+        
+        With unsynced_for (a spreadsheet id), only transactions that were never
+        synced to their account's sheet there, or were synced before they had a
+        category and have one now, are returned. sheets maps account id to the
+        name of that sheet; accounts missing from it count as never synced.
+        """
         query = """
             SELECT 
-                t.id, t.date, t.description, t.amount, t.balance,
+                t.id, t.account_id, t.date, t.description, t.amount, t.balance,
                 c.name as category, pc.name as parent_category,
                 a.account_number, a.account_name
             FROM transactions t
@@ -135,44 +360,98 @@ class Database:
             LEFT JOIN accounts a ON t.account_id = a.id
         """
         
+        conditions = []
+        params = ()
+        if unsynced_for is not None:
+            query += """
+            LEFT JOIN json_each(?) sh ON sh.key = CAST(t.account_id AS TEXT)
+            LEFT JOIN synced_transactions s
+                ON s.spreadsheet_id = ? AND s.sheet = sh.value AND s.transaction_id = t.id
+            """
+            params += (json.dumps(sheets or {}), unsynced_for)
+            conditions.append("(s.transaction_id IS NULL OR (s.categorized = 0 AND pc.name IS NOT NULL))")
         if account_id:
-            query += " WHERE t.account_id = ?"
-            params = (account_id,)
-        else:
-            params = ()
+            conditions.append("t.account_id = ?")
+            params += (account_id,)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
         
-        query += " ORDER BY t.date DESC"
+        if order_by not in TRANSACTION_ORDERINGS:
+            raise ValueError(f"Unknown transaction ordering: {order_by!r}")
+        query += " ORDER BY " + TRANSACTION_ORDERINGS[order_by]
         
         if limit:
-            query += f" LIMIT {limit}"
+            query += " LIMIT ?"
+            params += (limit,)
+        
+        with self._read() as conn:
+            return _fetch_dicts(conn, query, params)
+    
+    def mark_synced(self, spreadsheet_id: str, synced: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Record transactions as written to a spreadsheet.
+        
+        Each entry is (sheet name, transaction as returned by get_transactions).
+        """
+        params = [
+            (spreadsheet_id, sheet, tx['id'], tx.get('parent_category') is not None)
+            for sheet, tx in synced
+        ]
+        
+        with self.bulk():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO synced_transactions (spreadsheet_id, sheet, transaction_id, categorized) "
+                "VALUES (?, ?, ?, ?)",
+                params
+            )
+    
+    def clear_synced(self, spreadsheet_id: str, sheets: Iterable[str]):
+        """Forget what was written to these sheets, e.g. after they were recreated empty."""
+        with self.bulk():
+            self.conn.executemany(
+                "DELETE FROM synced_transactions WHERE spreadsheet_id = ? AND sheet = ?",
+                [(spreadsheet_id, sheet) for sheet in sheets]
+            )
+    
+    def get_uncategorized(self) -> List[Tuple[int, str]]:
+        """Get (id, description) of every transaction without a category."""
+        with self._read() as conn:
+            return conn.execute("SELECT id, description FROM transactions WHERE category_id IS NULL").fetchall()
+    
+    def set_categories(self, assignments: Iterable[Tuple[int, int]]):
+        """Set the category of many transactions in one SQLite transaction.
         
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        Each assignment is (category_id, transaction_id).
+        """
+        with self.bulk():
+            self.conn.executemany("UPDATE transactions SET category_id = ? WHERE id = ?", assignments)
     
     def get_uncategorized_count(self) -> int:
         """Get count of uncategorized transactions."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM transactions WHERE category_id IS NULL")
-        return cursor.fetchone()[0]
+        with self._read() as conn:
+            cursor = conn.execute("SELECT COUNT(*) FROM transactions WHERE category_id IS NULL")
+            return cursor.fetchone()[0]
     
     def get_accounts(self) -> List[Dict[str, Any]]:
         """Get all accounts."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id, account_number, account_name, account_type FROM accounts")
-        return [dict(row) for row in cursor.fetchall()]
+        with self._read() as conn:
+            return _fetch_dicts(conn, "SELECT id, account_number, account_name, account_type FROM accounts")
     
     def update_account_name(self, account_number: str, custom_name: str) -> bool:
         """Update the custom name for an account."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        cursor = self._write_cursor.execute(
             "UPDATE accounts SET account_name = ? WHERE account_number = ?",
             (custom_name, account_number)
         )
-        self.conn.commit()
+        self._commit()
         return cursor.rowcount > 0
     
     def close(self):
-        """Close database connection."""
+        """Close the writer and any pooled reader connections."""
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
         self.conn.close()
 
 
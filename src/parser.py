@@ -1,19 +1,134 @@
 """CIBC PDF statement parser."""
-import pdfplumber
 import re
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, Iterator
+
+# PyMuPDF extracts text much faster than pdfplumber; fall back when it isn't installed
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+    import pdfplumber
+
+# Patterns used while parsing, compiled once at import
+_BANK_ACCT_NUM_RE = re.compile(r'Account number\s*(\d{2}-\d{5})')
+_CC_ACCT_NUM_RE = re.compile(r'Account number\s*(\d{4}\s+X+\s+X+\s+\d{4})')
+_CC_NUM_RE = re.compile(r'(\d{4}\s+X+\s+X+\s+\d{4})')
+# Bank transaction lines are matched across a whole page at once; [^\S\n] keeps each match on one line
+_BANK_TX_RE = re.compile(
+    r'^([A-Z][a-z]{2}[^\S\n]+\d{1,2})[^\S\n]+(.+?)[^\S\n]+([\d,]+\.\d{2})[^\S\n]+([\d,]+\.\d{2})$',
+    re.MULTILINE
+)
+_BANK_HEADER_RE = re.compile(r'Date Description Withdrawals|Transaction details')
+_CC_TX_RE = re.compile(r'([A-Z][a-z]{2}\s+\d{2})\s+([A-Z][a-z]{2}\s+\d{2})\s+(.+?)\s+([\d,]+\.\d{2})$')
+# Any of the section/skip markers checked in _parse_transaction_page; most lines
+# contain none, and one scan rules them all out
+_CC_MARKER_RE = re.compile(
+    r'Trans Post|date date Description|Spend Categories|Card number|Page'
+    r'|Information about your|PAYMENT THANK YOU|Total payments'
+)
+# Every transaction line starts with a month abbreviation; checked before running _CC_TX_RE
+_MONTHS = frozenset(("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"))
+# CIBC spend categories printed after the credit card description, longest first
+_CAT_SUFFIXES = tuple(sorted((
+    "Health and Education",
+    "Restaurants",
+    "Retail and Grocery",
+    "Professional and Financial Services",
+    "Gas and Groceries",
+    "Gas Stations",
+), key=len, reverse=True))
+
+# Vertical distance (in points) within which words are treated as one line,
+# same default as pdfplumber's extract_text
+LINE_TOLERANCE = 3
+
+
+def _strip_spend_category(description: str) -> str:
+    """Remove a trailing CIBC spend category (preceded by whitespace) from a description."""
+    for suffix in _CAT_SUFFIXES:
+        if description.endswith(suffix) and description[-len(suffix) - 1:-len(suffix)].isspace():
+            return description[:-len(suffix)]
+    return description
+
+
+@lru_cache(maxsize=1024)
+def _parse_date(date_str: str, year: int) -> str:
+    """Convert 'Sep 06' to '2025-09-06'; a statement only has a few dozen distinct dates."""
+    try:
+        date_obj = datetime.strptime(f"{date_str} {year}", "%b %d %Y")
+        return date_obj.strftime("%Y-%m-%d")
+    except ValueError:
+        return date_str
+
+
+def _parse_amount(amount_str: str) -> float:
+    """Convert '1,234.56' to 1234.56, skipping the replace for amounts under 1,000."""
+    if ',' in amount_str:
+        amount_str = amount_str.replace(',', '')
+    return float(amount_str)
+
+
+def _pymupdf_page_text(page) -> str:
+    """Rebuild page text line by line, the way pdfplumber lays it out.
+    
+    PyMuPDF's plain text output emits each column as its own line, which
+    would break the single-line transaction regexes below.
+    """
+    words = sorted(page.get_text("words"), key=lambda w: (w[1], w[0]))
+    
+    lines = []
+    current = []
+    last_top = None
+    for word in words:
+        if last_top is not None and word[1] - last_top > LINE_TOLERANCE:
+            lines.append(current)
+            current = []
+        current.append(word)
+        last_top = word[1]
+    if current:
+        lines.append(current)
+    
+    return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
 
 
 class CIBCParser:
     def __init__(self, pdf_path: str):
         self.pdf_path = pdf_path
-        self.pdf = pdfplumber.open(pdf_path)
+        if pymupdf is not None:
+            self.pdf = pymupdf.open(pdf_path)
+            self.pages = self.pdf  # pages are loaded on access
+        else:
+            self.pdf = pdfplumber.open(pdf_path)
+            self.pages = self.pdf.pages
+        self._first_page_text = None
         self.statement_type = self._detect_statement_type()
     
+    def _page_text(self, index: int) -> str:
+        """Extract the text of the page at index.
+        
+        Only the first page's text is kept, since it is read for both the
+        statement type and the account info; the rest are extracted as the
+        parse reaches them so a long statement never sits in memory at once.
+        """
+        if index == 0 and self._first_page_text is not None:
+            return self._first_page_text
+        
+        page = self.pages[index]
+        if pymupdf is not None:
+            text = _pymupdf_page_text(page)
+        else:
+            text = page.extract_text() or ''
+            page.close()  # drop pdfplumber's cached layout objects
+        
+        if index == 0:
+            self._first_page_text = text
+        return text
+    
     def _detect_statement_type(self) -> str:
         """Detect if this is a credit card or bank account statement."""
-        first_page = self.pdf.pages[0].extract_text()
+        first_page = self._page_text(0)
         
         if "Account Statement" in first_page and "Branch transit number" in first_page:
             return "bank_account"
@@ -24,18 +139,18 @@ class CIBCParser:
     
     def extract_account_info(self) -> Dict[str, str]:
         """Extract account information from first page."""
-        first_page = self.pdf.pages[0].extract_text()
+        first_page = self._page_text(0)
         
         if self.statement_type == "bank_account":
             # Bank account format: "Account number\n87-40798"
-            account_match = re.search(r'Account number\s*(\d{2}-\d{5})', first_page)
+            account_match = _BANK_ACCT_NUM_RE.search(first_page)
             account_number = account_match.group(1) if account_match else "UNKNOWN"
             account_type = "CIBC Bank Account"
         else:
             # Credit card format: "Account number 4505 XXXX XXXX 7008"
-            account_match = re.search(r'Account number\s*(\d{4}\s+X+\s+X+\s+\d{4})', first_page)
+            account_match = _CC_ACCT_NUM_RE.search(first_page)
             if not account_match:
-                account_match = re.search(r'(\d{4}\s+X+\s+X+\s+\d{4})', first_page)
+                account_match = _CC_NUM_RE.search(first_page)
             
             account_number = account_match.group(1).replace(' ', '') if account_match else "UNKNOWN"
             
@@ -52,97 +167,83 @@ class CIBCParser:
             "account_type": account_type
         }
     
-    def parse_transactions(self) -> List[Dict[str, Any]]:
-        """Parse all transactions from the statement."""
+    def parse_transactions(self) -> Iterator[Dict[str, Any]]:
+        """Parse all transactions from the statement, yielding them page by page."""
         if self.statement_type == "bank_account":
             return self._parse_bank_account_transactions()
         else:
             return self._parse_credit_card_transactions()
     
-    def _parse_credit_card_transactions(self) -> List[Dict[str, Any]]:
+    def _parse_credit_card_transactions(self) -> Iterator[Dict[str, Any]]:
         """Parse credit card transactions."""
-        transactions = []
-        
-        for page in self.pdf.pages:
-            text = page.extract_text()
+        for index in range(len(self.pages)):
+            text = self._page_text(index)
             
             # Look for transaction sections
             if "Your new charges and credits" in text or "Transactions" in text:
-                transactions.extend(self._parse_transaction_page(text))
-        
-        return transactions
+                yield from self._parse_transaction_page(text)
     
-    def _parse_bank_account_transactions(self) -> List[Dict[str, Any]]:
+    def _parse_bank_account_transactions(self) -> Iterator[Dict[str, Any]]:
         """Parse bank account transactions."""
-        transactions = []
         current_year = datetime.now().year
         
-        for page in self.pdf.pages:
-            text = page.extract_text()
-            lines = text.split('\n')
+        for index in range(len(self.pages)):
+            text = self._page_text(index)
             
-            in_transaction_section = False
+            # Transactions start on the line after the header
+            header = _BANK_HEADER_RE.search(text)
+            if header is None:
+                continue
+            section_start = text.find('\n', header.end()) + 1
+            if section_start == 0:
+                continue
             
-            for line in lines:
-                # Start parsing after header
-                if "Date Description Withdrawals" in line or "Transaction details" in line:
-                    in_transaction_section = True
-                    continue
+            # Format: Sep 2 VISA DEBIT RETAIL PURCHASE 37.67 898.18
+            for match in _BANK_TX_RE.finditer(text, section_start):
+                line = match.group(0)
                 
-                if not in_transaction_section:
+                # Skip opening balance and any repeated header line
+                if "Opening balance" in line or _BANK_HEADER_RE.search(line):
                     continue
                 
-                # Skip opening balance line
-                if "Opening balance" in line:
-                    continue
+                date_str = match.group(1)
+                description = match.group(2).strip()
+                amount = _parse_amount(match.group(3))
+                balance = _parse_amount(match.group(4))
                 
-                # Parse transaction line
-                # Format: Sep 2 VISA DEBIT RETAIL PURCHASE 37.67 898.18
-                match = re.match(
-                    r'([A-Z][a-z]{2}\s+\d{1,2})\s+(.+?)\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})$',
-                    line
-                )
+                # Convert date
+                trans_date = _parse_date(date_str, current_year)
                 
-                if match:
-                    date_str = match.group(1)
-                    description = match.group(2).strip()
-                    amount = float(match.group(3).replace(',', ''))
-                    balance = float(match.group(4).replace(',', ''))
-                    
-                    # Convert date
-                    trans_date = self._parse_date(date_str, current_year)
-                    
-                    # Bank account shows withdrawals as positive, deposits on next column
-                    # For consistency, withdrawals are negative in our system
-                    transactions.append({
-                        "date": trans_date,
-                        "description": description,
-                        "amount": -amount,  # Withdrawals as negative
-                        "balance": balance
-                    })
-        
-        return transactions
+                # Bank account shows withdrawals as positive, deposits on next column
+                # For consistency, withdrawals are negative in our system
+                yield {
+                    "date": trans_date,
+                    "description": description,
+                    "amount": -amount,  # Withdrawals as negative
+                    "balance": balance
+                }
     
-    def _parse_transaction_page(self, text: str) -> List[Dict[str, Any]]:
+    def _parse_transaction_page(self, text: str) -> Iterator[Dict[str, Any]]:
         """Parse transactions from a page of text."""
-        transactions = []
         lines = text.split('\n')
         
         in_transaction_section = False
         current_year = datetime.now().year
         
         for i, line in enumerate(lines):
+            has_marker = _CC_MARKER_RE.search(line) is not None
+            
             # Detect transaction section start - check for the header or "Spend Categories"
-            if ("Trans Post" in line) or ("date date Description" in line) or ("Spend Categories" in line):
+            if has_marker and (("Trans Post" in line) or ("date date Description" in line) or ("Spend Categories" in line)):
                 in_transaction_section = True
                 continue
             
             # Skip card number line
-            if "Card number" in line:
+            if has_marker and "Card number" in line:
                 continue
             
             # Stop at page footer or next section
-            if ("Page" in line and "of" in line) or "Information about your" in line:
+            if has_marker and (("Page" in line and "of" in line) or "Information about your" in line):
                 in_transaction_section = False
                 continue
             
@@ -150,15 +251,16 @@ class CIBCParser:
                 continue
             
             # Skip special characters and payment lines
-            if "PAYMENT THANK YOU" in line or "Total payments" in line or line.strip() == "Ý":
+            if (has_marker and ("PAYMENT THANK YOU" in line or "Total payments" in line)) or line.strip() == "Ý":
+                continue
+            
+            # Most remaining lines are notices and totals; skip them without the regex
+            if line[:3] not in _MONTHS:
                 continue
             
             # Parse transaction line
             # Format: Sep 06 Sep 08 SHOPPERS DRUG MART #13 TORONTO ON Health and Education 26.88
-            tx_match = re.match(
-                r'([A-Z][a-z]{2}\s+\d{2})\s+([A-Z][a-z]{2}\s+\d{2})\s+(.+?)\s+([\d,]+\.\d{2})$',
-                line
-            )
+            tx_match = _CC_TX_RE.match(line)
             
             if tx_match:
                 trans_date_str = tx_match.group(1)
@@ -167,34 +269,24 @@ class CIBCParser:
                 amount_str = tx_match.group(4)
                 
                 # Clean description (remove CIBC category if present at end)
-                description = re.sub(
-                    r'\s+(Health and Education|Restaurants|Retail and Grocery|Professional and Financial Services|Gas and Groceries|Gas Stations)$',
-                    '', 
-                    description_raw
-                ).strip()
+                description = _strip_spend_category(description_raw).strip()
                 
                 # Convert date to YYYY-MM-DD
-                trans_date = self._parse_date(trans_date_str, current_year)
+                trans_date = _parse_date(trans_date_str, current_year)
                 
                 # Convert amount
-                amount = float(amount_str.replace(',', ''))
+                amount = _parse_amount(amount_str)
                 
-                transactions.append({
+                yield {
                     "date": trans_date,
                     "description": description,
                     "amount": amount,
                     "balance": None  # CIBC credit card statements don't show running balance
-                })
-        
-        return transactions
+                }
     
     def _parse_date(self, date_str: str, year: int) -> str:
         """Convert 'Sep 06' to '2025-09-06'."""
-        try:
-            date_obj = datetime.strptime(f"{date_str} {year}", "%b %d %Y")
-            return date_obj.strftime("%Y-%m-%d")
-        except ValueError:
-            return date_str
+        return _parse_date(date_str, year)
     
     def close(self):
         """Close PDF file."""
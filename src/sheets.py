@@ -1,10 +1,142 @@
 """Google Sheets integration for transaction syncing."""
+import hashlib
+import json
 import os
-from typing import List, Dict, Any
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache, partial
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterable, Optional, Set, Tuple
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+# Sheets read concurrently by prefetch(); each thread gets its own service
+READ_WORKERS = 4
+
+# Rate limiting (429) and transient server errors are retried with exponential backoff
+RETRY_STATUSES = (429, 500, 503)
+MAX_RETRIES = 6
+MAX_BACKOFF = 32  # seconds
+
+# values.append isn't idempotent: after a 500/503 the rows may already have been
+# written, so appends are only retried when rate limited
+APPEND_RETRY_STATUSES = (429,)
+
+# Most requests Google accepts in one batch HTTP request
+BATCH_LIMIT = 100
+
+# Rows sent per values.append, keeping each request well under the payload limit
+APPEND_CHUNK = 500
+
+# Keys of the rows already in each sheet are kept here, so a sync doesn't have to
+# download the sheet to find duplicates
+INDEX_PATH = Path.home() / ".cache" / "fintrack" / "sheets.db"
+
+# Transaction fields written to columns A-F, in order
+_ROW_FIELDS = itemgetter('date', 'description', 'amount', 'balance', 'parent_category', 'category')
+
+# Characters replaced with "_" in account names used as sheet titles
+_SHEET_NAME_TABLE = str.maketrans({' ': '_', '/': '_', '\\': '_'})
+
+# First row number in an append response's updatedRange, e.g. "Sheet!A12:F14"
+_UPDATED_RANGE_ROW_RE = re.compile(r'![A-Z]+(\d+)')
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Seconds to wait after a failed attempt: the server's Retry-After when given,
+    otherwise exponential backoff with jitter."""
+    if retry_after is not None and retry_after.isdigit():
+        return int(retry_after)
+    return min(MAX_BACKOFF, 2 ** attempt) + random.random()
+
+
+def _execute(request, retry_statuses: Tuple[int, ...] = RETRY_STATUSES):
+    """Execute an API (or batch) request, retrying rate-limit and transient errors.
+    
+    Failures with one of retry_statuses are retried after _retry_delay();
+    other errors, and the last failure, are raised.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status not in retry_statuses or attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(attempt, e.resp.get('retry-after')))
+
+
+@lru_cache(maxsize=None)
+def _sheet_range(sheet_name: str, cells: str) -> str:
+    """A1 range for cells (e.g. "A:F") of a sheet; built once per sheet and range."""
+    return f"{sheet_name}!{cells}"
+
+
+def _chunks(items: Iterable, size: int) -> Iterable[List]:
+    """Split items into lists of at most size."""
+    it = iter(items)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _row_runs(row_numbers: Iterable[int]) -> List[Tuple[int, int]]:
+    """(first, last) of each run of consecutive row numbers, in order."""
+    runs = []
+    for row_number in sorted(row_numbers):
+        if runs and row_number == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], row_number)
+        else:
+            runs.append((row_number, row_number))
+    return runs
+
+
+def _amount_key(amount) -> str:
+    """Canonical form of an amount, so -10.0, "-10" and "-$10.00" compare equal.
+    
+    Sheets hands back amounts the way it displays them, not as they were written.
+    """
+    if amount in ('', None):
+        return ''
+    try:
+        value = Decimal(str(amount).replace('$', '').replace(',', ''))
+        return format(value.quantize(Decimal('0.01')), 'f')
+    except InvalidOperation:
+        return str(amount)
+
+
+def _row_key(date: str, description: str, amount) -> int:
+    """64-bit key identifying a sheet row by date, description (case-insensitive) and amount."""
+    key = f"{date}|{description.casefold()}|{_amount_key(amount)}"
+    # Signed so it fits an SQLite INTEGER in the local index
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def _tx_row(tx: Dict[str, Any]) -> Tuple:
+    """Sheet row (columns A-F) for a transaction dict."""
+    try:
+        date, description, amount, balance, parent_category, category = _ROW_FIELDS(tx)
+    except KeyError:  # Not a full database row; missing fields are left blank
+        date, description, amount, balance, parent_category, category = _ROW_FIELDS(defaultdict(str, tx))
+    return (date, description, amount, balance or '', parent_category, category)
+
+
+def _tx_ids(transactions: Iterable[Dict[str, Any]]) -> List[int]:
+    """Database ids of the transactions that have one."""
+    return [tx['id'] for tx in transactions if 'id' in tx]
+
+
+def _tx_key(tx: Dict[str, Any]) -> int:
+    """Row key for a transaction dict."""
+    return _row_key(tx.get('date', ''), tx.get('description', ''), tx.get('amount', ''))
+
 
 class SheetsClient:
     def __init__(self, credentials_file: str, spreadsheet_id: str):
@@ -13,39 +145,202 @@ class SheetsClient:
             credentials_file,
             scopes=['https://www.googleapis.com/auth/spreadsheets']
         )
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+        # The HTTP client under a service isn't thread-safe, so each thread builds its own
+        self._local = threading.local()
+        self._sheet_ids = None  # {title: sheetId}, loaded on first use
+        self._grid_rows = {}  # {title: grid row count}, loaded with the sheet ids
+        self._prefetched = {}  # {title: (row count, existing rows)} from prefetch()
+        self._created = set()  # Titles of the sheets get_or_create_sheet() has created
+        self._index = self._open_index()
+    
+    def _open_index(self) -> Optional[sqlite3.Connection]:
+        """Open the local row index; without it every sync reads the sheet instead."""
+        try:
+            INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(INDEX_PATH, isolation_level=None)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sheets (
+                    spreadsheet_id TEXT NOT NULL,
+                    sheet TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    PRIMARY KEY (spreadsheet_id, sheet)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    spreadsheet_id TEXT NOT NULL,
+                    sheet TEXT NOT NULL,
+                    row_key INTEGER NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    categorized INTEGER NOT NULL,
+                    PRIMARY KEY (spreadsheet_id, sheet, row_key)
+                ) WITHOUT ROWID
+            """)
+            return conn
+        except (OSError, sqlite3.Error):
+            return None
+    
+    def _load_index(self, sheet_name: str,
+                    keys: Optional[List[int]] = None) -> Optional[Tuple[int, Dict[int, Tuple[int, bool]]]]:
+        """Row count and {row key: (row number, categorized)} of a sheet, if indexed locally.
+        
+        With keys, only those rows are looked up, so a sync holds entries for
+        its own transactions rather than for every row of the sheet.
+        """
+        if self._index is None:
+            return None
+        
+        row = self._index.execute(
+            "SELECT row_count FROM sheets WHERE spreadsheet_id = ? AND sheet = ?",
+            (self.spreadsheet_id, sheet_name)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        query = "SELECT row_key, row_number, categorized FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ?"
+        params = (self.spreadsheet_id, sheet_name)
+        if keys is not None:
+            query += " AND row_key IN (SELECT value FROM json_each(?))"
+            params += (json.dumps(keys),)
+        cursor = self._index.execute(query, params)
+        return row[0], {key: (row_number, bool(categorized)) for key, row_number, categorized in cursor}
+    
+    def _is_indexed(self, sheet_name: str) -> bool:
+        """Whether a sheet has a local index (and so existed as of the last sync)."""
+        return self._load_index(sheet_name, []) is not None
+    
+    def _update_index(self, sheet_name: str, row_count: int, entries: Dict[int, Tuple[int, bool]],
+                      replace: bool = False):
+        """Record rows in the local index; with replace, the sheet's old entries are dropped first."""
+        if self._index is None:
+            return
+        
+        with self._index:
+            self._index.execute("BEGIN")
+            if replace:
+                self._drop_index(sheet_name)
+            self._index.execute(
+                "INSERT OR REPLACE INTO sheets (spreadsheet_id, sheet, row_count) VALUES (?, ?, ?)",
+                (self.spreadsheet_id, sheet_name, row_count)
+            )
+            self._index.executemany(
+                "INSERT OR REPLACE INTO sheet_rows (spreadsheet_id, sheet, row_key, row_number, categorized) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(self.spreadsheet_id, sheet_name, key, row_number, categorized)
+                 for key, (row_number, categorized) in entries.items()]
+            )
+    
+    def _drop_index(self, sheet_name: str):
+        """Forget a sheet's local index, so the next sync reads the sheet again."""
+        if self._index is None:
+            return
+        
+        for table in ("sheets", "sheet_rows"):
+            self._index.execute(
+                f"DELETE FROM {table} WHERE spreadsheet_id = ? AND sheet = ?",
+                (self.spreadsheet_id, sheet_name)
+            )
+    
+    @property
+    def service(self):
+        """Sheets API service for the calling thread.
+        
+        The API description comes from the copy bundled with googleapiclient,
+        with the discovery cache (and its probing for a cache backend) turned off.
+        """
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = build(
+                'sheets', 'v4', credentials=self.credentials, static_discovery=True, cache_discovery=False
+            )
+        return service
+    
+    @staticmethod
+    def sheet_name_for(account_number: str, account_name: str = None) -> str:
+        """Sheet title used for an account."""
+        # Use custom name if provided, otherwise use account number
+        if account_name:
+            # Sanitize custom name for sheet title
+            return account_name[:30].translate(_SHEET_NAME_TABLE)  # Limit length
+        # Fallback to account number
+        return f"Account_{account_number.replace(' ', '_')}"
+    
+    def prefetch(self, sheet_names: Iterable[str]):
+        """Read the row counts and existing rows of several sheets concurrently.
+        
+        sync_transactions() uses the prefetched rows instead of reading them
+        itself; sheets that don't exist yet are skipped.
+        """
+        names = list(dict.fromkeys(sheet_names))
+        if not names:
+            return
+        
+        # Sheets indexed locally don't need reading at all
+        names = [name for name in names if not self._is_indexed(name)]
+        if not names:
+            return
+        
+        existing_sheets = self._load_sheets()
+        names = [name for name in names if name in existing_sheets]
+        if not names:
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(names))) as executor:
+            for name, result in zip(names, executor.map(self.get_row_count_and_existing, names)):
+                self._prefetched[name] = result
+    
+    def _load_sheets(self) -> Dict[str, int]:
+        """Get the {title: sheetId} map, fetching spreadsheet metadata only once."""
+        if self._sheet_ids is None:
+            spreadsheet = _execute(self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id,
+                fields='sheets.properties(sheetId,title,gridProperties.rowCount)'
+            ))
+            
+            self._sheet_ids = {}
+            for sheet in spreadsheet.get('sheets', []):
+                properties = sheet['properties']
+                self._sheet_ids[properties['title']] = properties['sheetId']
+                self._grid_rows[properties['title']] = properties.get('gridProperties', {}).get('rowCount', 0)
+        return self._sheet_ids
+    
+    def _sheet_exists(self, sheet_name: str) -> bool:
+        """Whether a sheet exists, trusting the local index until metadata has been fetched."""
+        if self._sheet_ids is None and self._is_indexed(sheet_name):
+            return True
+        return sheet_name in self._load_sheets()
     
     def get_or_create_sheet(self, sheet_name: str) -> str:
         """Get or create a sheet with the given name."""
         try:
             # Check if sheet exists
-            spreadsheet = self.service.spreadsheets().get(
-                spreadsheetId=self.spreadsheet_id
-            ).execute()
-            
-            sheets = spreadsheet.get('sheets', [])
-            for sheet in sheets:
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet_name
+            if self._sheet_exists(sheet_name):
+                return sheet_name
             
-            # Create new sheet
+            # Create the sheet and write its formatted header in one batchUpdate; the
+            # sheet id is chosen here so the header requests can refer to it
+            sheet_id = max(self._load_sheets().values(), default=0) + 1
             body = {
                 'requests': [{
                     'addSheet': {
                         'properties': {
+                            'sheetId': sheet_id,
                             'title': sheet_name
                         }
                     }
-                }]
+                }] + self._header_requests(sheet_id)
             }
             
-            self.service.spreadsheets().batchUpdate(
+            _execute(self.service.spreadsheets().batchUpdate(
                 spreadsheetId=self.spreadsheet_id,
                 body=body
-            ).execute()
+            ))
             
-            # Add header row
-            self._write_header(sheet_name)
+            self._sheet_ids[sheet_name] = sheet_id
+            self._created.add(sheet_name)
+            # A new sheet holds just its header; this also replaces any index left
+            # behind by a deleted sheet of the same name
+            self._update_index(sheet_name, 1, {}, replace=True)
             
             return sheet_name
             
@@ -53,23 +348,23 @@ class SheetsClient:
             print(f"Error accessing sheet: {e}")
             raise
     
-    def _write_header(self, sheet_name: str):
-        """Write header row to sheet."""
-        headers = [['Date', 'Description', 'Amount', 'Balance', 'Category', 'Subcategory']]
+    def _header_requests(self, sheet_id: int) -> List[Dict[str, Any]]:
+        """batchUpdate requests writing and formatting the header row of a sheet."""
+        headers = ['Date', 'Description', 'Amount', 'Balance', 'Category', 'Subcategory']
         
-        self.service.spreadsheets().values().update(
-            spreadsheetId=self.spreadsheet_id,
-            range=f"{sheet_name}!A1:F1",
-            valueInputOption='RAW',
-            body={'values': headers}
-        ).execute()
-        
-        # Format header row
-        body = {
-            'requests': [{
+        return [
+            {
+                'updateCells': {
+                    'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+                    'rows': [{'values': [{'userEnteredValue': {'stringValue': h}} for h in headers]}],
+                    'fields': 'userEnteredValue'
+                }
+            },
+            {
+                # Format header row
                 'repeatCell': {
                     'range': {
-                        'sheetId': self._get_sheet_id(sheet_name),
+                        'sheetId': sheet_id,
                         'startRowIndex': 0,
                         'endRowIndex': 1
                     },
@@ -81,186 +376,509 @@ class SheetsClient:
                     },
                     'fields': 'userEnteredFormat(backgroundColor,textFormat)'
                 }
-            }]
-        }
-        
-        self.service.spreadsheets().batchUpdate(
-            spreadsheetId=self.spreadsheet_id,
-            body=body
-        ).execute()
-    
-    def _get_sheet_id(self, sheet_name: str) -> int:
-        """Get sheet ID by name."""
-        spreadsheet = self.service.spreadsheets().get(
-            spreadsheetId=self.spreadsheet_id
-        ).execute()
-        
-        for sheet in spreadsheet.get('sheets', []):
-            if sheet['properties']['title'] == sheet_name:
-                return sheet['properties']['sheetId']
-        
-        return 0
-    
-    def get_existing_transactions(self, sheet_name: str, limit: int = 1000) -> List[List[str]]:
-        """Get last N transactions from sheet to check for duplicates."""
-        try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range=f"{sheet_name}!A2:F{limit+2}"  # Skip header
-            ).execute()
-            
-            return result.get('values', [])
-        except HttpError:
-            return []
+            }
+        ]
     
     def append_transactions(self, sheet_name: str, transactions: List[Dict[str, Any]]):
-        """Append transactions to sheet."""
+        """Append transactions to sheet, recording them in the local index like a sync does."""
         if not transactions:
             return
         
+        local = self._load_index(sheet_name, [])
+        row_count = local[0] if local is not None else 0
+        for chunk in _chunks(transactions, APPEND_CHUNK):
+            response = _execute(self._append_request(sheet_name, chunk), APPEND_RETRY_STATUSES)
+            self._index_appended(sheet_name, row_count, chunk, response)
+        self._grid_rows.pop(sheet_name, None)  # Appends can grow the grid
+        
+        print(f"✓ Appended {len(transactions)} transactions to '{sheet_name}'")
+    
+    def _append_request(self, sheet_name: str, transactions: List[Dict[str, Any]]):
+        """Build (without executing) the request appending transactions to a sheet."""
         # Convert transactions to rows
-        rows = []
-        for tx in transactions:
-            rows.append([
-                tx.get('date', ''),
-                tx.get('description', ''),
-                tx.get('amount', ''),
-                tx.get('balance', '') if tx.get('balance') else '',
-                tx.get('parent_category', ''),
-                tx.get('category', '')
-            ])
+        rows = list(map(_tx_row, transactions))
         
-        # Append to sheet
-        self.service.spreadsheets().values().append(
+        return self.service.spreadsheets().values().append(
             spreadsheetId=self.spreadsheet_id,
-            range=f"{sheet_name}!A:F",
+            range=_sheet_range(sheet_name, "A:F"),
             valueInputOption='USER_ENTERED',
             body={'values': rows}
-        ).execute()
-        
-        print(f"✓ Appended {len(rows)} transactions to '{sheet_name}'")
+        )
     
     def check_row_count(self, sheet_name: str) -> int:
-        """Get row count for a sheet."""
+        """Get row count for a sheet.
+        
+        This is the grid's row count from the spreadsheet metadata, so no cells
+        are downloaded. It includes blank rows at the bottom of the grid (a new
+        sheet starts with 1000), so it can overstate the rows actually used.
+        """
+        try:
+            self._load_sheets()
+            if sheet_name not in self._grid_rows:
+                spreadsheet = _execute(self.service.spreadsheets().get(
+                    spreadsheetId=self.spreadsheet_id,
+                    ranges=[_sheet_range(sheet_name, "A1")],
+                    fields='sheets.properties.gridProperties.rowCount'
+                ))
+                self._grid_rows[sheet_name] = spreadsheet['sheets'][0]['properties']['gridProperties']['rowCount']
+            return self._grid_rows[sheet_name]
+        except (HttpError, KeyError, IndexError):
+            return 0
+    
+    def get_row_count_and_existing(self, sheet_name: str, limit: int = 1000) -> Tuple[int, List[List[str]]]:
+        """Get the row count and the first N transactions (columns A-E) of a sheet.
+        
+        Only used to rebuild a sheet's local index. When the read comes back
+        short it holds every row, so the count is exact; otherwise it's the
+        grid row count from check_row_count().
+        """
         try:
-            result = self.service.spreadsheets().values().get(
+            result = _execute(self.service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id,
-                range=f"{sheet_name}!A:A"
-            ).execute()
-            
-            rows = result.get('values', [])
-            return len(rows)
+                range=_sheet_range(sheet_name, f"A2:E{limit+2}"),  # Skip header
+                fields='values'
+            ))
         except HttpError:
-            return 0
+            return 0, []
+        
+        existing = result.get('values', [])
+        if len(existing) <= limit:
+            return len(existing) + 1, existing  # Plus the header
+        return self.check_row_count(sheet_name) or len(existing) + 1, existing
     
-    def sync_transactions(self, transactions: List[Dict[str, Any]], account_number: str, account_name: str = None):
-        """Sync transactions to appropriate sheet."""
-        # Use custom name if provided, otherwise use account number
-        if account_name:
-            # Sanitize custom name for sheet title
-            sheet_name = account_name.replace(' ', '_').replace('/', '_').replace('\\', '_')[:30]  # Limit length
-        else:
-            # Fallback to account number
-            sheet_name = f"Account_{account_number.replace(' ', '_')}"
+    def sync_transactions(self, transactions: List[Dict[str, Any]], account_number: str,
+                          account_name: str = None) -> Tuple[List[int], Set[str]]:
+        """Sync transactions to appropriate sheet; returns what sync_many() does."""
+        return self.sync_many([(transactions, account_number, account_name)])
+    
+    def sync_many(self, jobs: Iterable[Tuple[List[Dict[str, Any]], str, Optional[str]]]) -> Tuple[List[int], Set[str]]:
+        """Sync several accounts at once; each job is (transactions, account_number, account_name).
+        
+        All sheets are read up front, then the writes for every account go out
+        together: one values.batchUpdate carrying every sheet's category updates
+        and one append per sheet, sent in a single batch request.
+        
+        Returns the ids of the transactions the sheets are now up to date on
+        (those written, and those already there with nothing to change; a
+        transaction whose write failed is left out), and the names of the
+        sheets this sync had to create. A created sheet holds only what was
+        just written, so whatever was synced to a sheet of that name before
+        needs writing again.
+        """
+        synced = []
+        self._created = set()
+        jobs = list(jobs)
+        self.prefetch(self.sheet_name_for(account_number, account_name) for _, account_number, account_name in jobs)
+        
+        plans = []
+        planned_sheets = set()
+        for transactions, account_number, account_name in jobs:
+            # Two accounts writing to one sheet: the second must see the first one's rows
+            if self.sheet_name_for(account_number, account_name) in planned_sheets:
+                synced += self._write_plans(plans)
+                plans = []
+                planned_sheets = set()
+            
+            plans.append(self._plan_sync(transactions, account_number, account_name))
+            planned_sheets.add(self.sheet_name_for(account_number, account_name))
+        
+        synced += self._write_plans(plans)
+        return synced, self._created
+    
+    def _plan_sync(self, transactions: List[Dict[str, Any]], account_number: str,
+                   account_name: str = None) -> Dict[str, Any]:
+        """Work out which transactions a sheet needs appended or categorized."""
+        sheet_name = self.sheet_name_for(account_number, account_name)
         
         # Get or create sheet
         self.get_or_create_sheet(sheet_name)
         
-        # Check row count - create new sheet if over 10k
-        row_count = self.check_row_count(sheet_name)
+        # Check row count and get existing transactions to avoid duplicates
+        keys = list(map(_tx_key, transactions))
+        row_count, existing_index = self._get_index(sheet_name, keys)
+        
+        # Move on to a new sheet if over 10k; it's only created once there is something to append
         if row_count > 10000:
             sheet_name = f"{sheet_name}_2"
-            self.get_or_create_sheet(sheet_name)
-        
-        # Get existing transactions to avoid duplicates
-        existing = self.get_existing_transactions(sheet_name)
-        existing_set = {(row[0], row[1], row[2]) for row in existing if len(row) >= 3}
+            if self._sheet_exists(sheet_name):
+                row_count, existing_index = self._get_index(sheet_name, keys)
+            else:
+                row_count, existing_index = 1, {}
         
+        return self._plan_sheet(sheet_name, transactions, keys, row_count, existing_index)
+    
+    def _plan_sheet(self, sheet_name: str, transactions: List[Dict[str, Any]], keys: List[int],
+                    row_count: int, existing_index: Dict[int, Tuple[int, bool]]) -> Dict[str, Any]:
+        """Split transactions into new rows, category updates, and rows already in sync."""
         # Filter out duplicates and categorize new vs existing
         new_transactions = []
         update_transactions = []
+        in_sync = []
         
-        for tx in transactions:
-            key = (tx.get('date', ''), tx.get('description', ''), str(tx.get('amount', '')))
-            if key not in existing_set:
+        for tx, key in zip(transactions, keys):
+            existing_row = existing_index.get(key)
+            if existing_row is None:
                 new_transactions.append(tx)
             else:
-                # Check if this transaction needs category update
-                for existing_row in existing:
-                    if (len(existing_row) >= 3 and 
-                        existing_row[0] == tx.get('date', '') and 
-                        existing_row[1] == tx.get('description', '') and
-                        existing_row[2] == str(tx.get('amount', ''))):
-                        
-                        # Check if existing row has categories (columns 4 and 5)
-                        existing_category = existing_row[4] if len(existing_row) > 4 else ''
-                        if (not existing_category or existing_category == '') and tx.get('parent_category'):
-                            update_transactions.append(tx)
-                        break
+                # Check if existing row has categories (columns 4 and 5)
+                _, categorized = existing_row
+                if not categorized and tx.get('parent_category'):
+                    update_transactions.append(tx)
+                else:
+                    in_sync.append(tx)
         
         if update_transactions:
-            print(f"  📝 Updating {len(update_transactions)} transactions with categories...")
+            print(f"  📝 Updating {len(update_transactions)} transactions with categories in '{sheet_name}'...")
         if new_transactions:
-            print(f"  ➕ Adding {len(new_transactions)} new transactions...")
+            print(f"  ➕ Adding {len(new_transactions)} new transactions to '{sheet_name}'...")
         
-        # Update existing transactions with categories
-        if update_transactions:
-            self.update_transaction_categories(sheet_name, update_transactions)
+        if not new_transactions and not update_transactions:
+            print(f"✓ No new transactions to sync for '{sheet_name}'")
         
-        # Append new transactions
         if new_transactions:
-            self.append_transactions(sheet_name, new_transactions)
+            self.get_or_create_sheet(sheet_name)
         
-        if not new_transactions and not update_transactions:
-            print(f"✓ No new transactions to sync for '{sheet_name}'")
+        updates = self._find_category_rows(sheet_name, update_transactions, existing_index)
+        
+        return {
+            'sheet_name': sheet_name,
+            'transactions': transactions,
+            'keys': keys,
+            'row_count': row_count,
+            'existing_index': existing_index,
+            'new_transactions': new_transactions,
+            'update_transactions': update_transactions,
+            'in_sync': in_sync,
+            'updates': updates,
+        }
+    
+    def _write_plans(self, plans: List[Dict[str, Any]]) -> List[int]:
+        """Send the writes for planned syncs in as few HTTP requests as possible.
+        
+        Appends are split into APPEND_CHUNK-row chunks. A batch may run its
+        requests in any order, so the chunks of one sheet go out in successive
+        rounds of batches to keep its rows in order; each round carries one
+        chunk for every sheet. Returns the ids of the transactions now in sync.
+        
+        A sheet whose appends are rejected (400) because it was deleted by hand
+        is recreated and written again in the same run.
+        """
+        plans = self._check_category_rows(plans)
+        rounds = [[]]
+        append_errors = []
+        rejected = {}  # {sheet name: (plan, error)} for appends failing with 400
+        synced = [tx_id for plan in plans for tx_id in _tx_ids(plan['in_sync'])]
+        
+        # Every sheet's category updates share one values.batchUpdate
+        updated = [plan for plan in plans if plan['updates']]
+        data = [
+            entry for plan in updated
+            for entry in self._category_update_data(plan['sheet_name'], plan['updates'])
+        ]
+        if data:
+            def on_updated(request_id, response, exception):
+                if exception is not None:
+                    print(f"❌ Error updating categories: {exception}")
+                    for plan in updated:
+                        self._forget_missing_sheet(plan['sheet_name'], exception)
+                    return
+                for plan in updated:
+                    print(f"✓ Updated {len(plan['updates'])} transactions with categories in '{plan['sheet_name']}'")
+                    synced.extend(_tx_ids(plan['update_transactions']))
+                    self._update_index(plan['sheet_name'], plan['row_count'], {
+                        key: (plan['existing_index'][key][0], True)
+                        for key in map(_tx_key, plan['update_transactions'])
+                    })
+            
+            rounds[0].append((self._category_update_request(data), on_updated, RETRY_STATUSES))
+        
+        # No multi-sheet append exists, so each sheet gets its own request in the batch
+        for plan in plans:
+            chunks = list(_chunks(plan['new_transactions'], APPEND_CHUNK))
+            for i, chunk in enumerate(chunks):
+                def on_appended(request_id, response, exception, plan=plan, chunk=chunk, last=i == len(chunks) - 1):
+                    if exception is not None:
+                        if isinstance(exception, HttpError) and exception.resp.status == 400:
+                            rejected[plan['sheet_name']] = (plan, exception)
+                        else:
+                            append_errors.append(exception)
+                        return
+                    self._grid_rows.pop(plan['sheet_name'], None)  # Appends can grow the grid
+                    synced.extend(_tx_ids(chunk))
+                    if last:
+                        print(f"✓ Appended {len(plan['new_transactions'])} transactions to '{plan['sheet_name']}'")
+                    self._index_appended(plan['sheet_name'], plan['row_count'], chunk, response)
+                
+                if i == len(rounds):
+                    rounds.append([])
+                rounds[i].append((self._append_request(plan['sheet_name'], chunk), on_appended, APPEND_RETRY_STATUSES))
+        
+        for requests in rounds:
+            self._execute_batch(requests)
+            if append_errors:
+                raise append_errors[0]
+        
+        if rejected:
+            gone = self._missing_sheets(plan for plan, _ in rejected.values())
+            for sheet_name, (_, exception) in rejected.items():
+                if sheet_name not in gone:
+                    raise exception
+            synced += self._write_plans([self._recreate_sheet(plan) for plan, _ in rejected.values()])
+        
+        return synced
+    
+    def _check_category_rows(self, plans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Make sure the rows planned for category updates still hold their transactions.
+        
+        The row numbers come from the local index, which goes stale if the
+        sheet is sorted or rows are inserted or deleted by hand. A sheet whose
+        rows no longer match is re-read, its index rebuilt, and its plan redone.
+        """
+        checked = [plan for plan in plans if plan['updates']]
+        if not checked:
+            return plans
+        
+        try:
+            moved = self._moved_sheets([
+                (plan['sheet_name'], self._expected_keys(plan['existing_index'], plan['update_transactions']))
+                for plan in checked
+            ])
+        except HttpError as e:
+            # A sheet trusted from the local index may have been deleted by hand
+            gone = self._missing_sheets(checked) if e.resp.status == 400 else set()
+            if gone:
+                return self._check_category_rows([
+                    self._recreate_sheet(plan) if plan['sheet_name'] in gone else plan for plan in plans
+                ])
+            print(f"❌ Error updating categories: {e}")
+            for plan in checked:
+                plan['updates'] = {}
+            return plans
+        
+        replanned = []
+        for plan in plans:
+            if plan['sheet_name'] in moved:
+                print(f"  ↻ Rows in '{plan['sheet_name']}' have moved since the last sync; re-reading it...")
+                self._drop_index(plan['sheet_name'])
+                row_count, existing_index = self._get_index(plan['sheet_name'], plan['keys'])
+                plan = self._plan_sheet(plan['sheet_name'], plan['transactions'], plan['keys'],
+                                        row_count, existing_index)
+            replanned.append(plan)
+        return replanned
+    
+    def _missing_sheets(self, plans: Iterable[Dict[str, Any]]) -> Set[str]:
+        """Names of the planned sheets that freshly fetched metadata doesn't list."""
+        self._sheet_ids = None
+        sheet_ids = self._load_sheets()
+        return {plan['sheet_name'] for plan in plans if plan['sheet_name'] not in sheet_ids}
+    
+    def _recreate_sheet(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Recreate the sheet of a plan after it was deleted, and redo the plan for the empty sheet."""
+        print(f"  ↻ Sheet '{plan['sheet_name']}' no longer exists; recreating it...")
+        self.get_or_create_sheet(plan['sheet_name'])
+        return self._plan_sheet(plan['sheet_name'], plan['transactions'], plan['keys'], 1, {})
+    
+    @staticmethod
+    def _expected_keys(index: Dict[int, Tuple[int, bool]], transactions: List[Dict[str, Any]]) -> Dict[int, int]:
+        """{row number: row key} of the uncategorized indexed rows holding the given transactions."""
+        expected = {}
+        for key in map(_tx_key, transactions):
+            existing_row = index.get(key)
+            if existing_row is not None and not existing_row[1]:
+                expected[existing_row[0]] = key
+        return expected
+    
+    def _moved_sheets(self, checks: List[Tuple[str, Dict[int, int]]]) -> set:
+        """Names of the sheets whose rows no longer hold the expected keys.
+        
+        checks is [(sheet name, {row number: row key})]; columns A-C of every
+        row are read in one values.batchGet.
+        """
+        ranges = []
+        for sheet_name, expected in checks:
+            for first, last in _row_runs(expected):
+                ranges.append((sheet_name, first, last))
+        
+        if not ranges:
+            return set()
+        
+        result = _execute(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=[_sheet_range(sheet_name, f"A{first}:C{last}") for sheet_name, first, last in ranges],
+            fields='valueRanges(values)'
+        ))
+        
+        expected_by_sheet = dict(checks)
+        moved = set()
+        for (sheet_name, first, last), value_range in zip(ranges, result.get('valueRanges', [])):
+            rows = value_range.get('values', [])
+            for row_number in range(first, last + 1):
+                row = rows[row_number - first] if row_number - first < len(rows) else []
+                if len(row) < 3 or _row_key(row[0], row[1], row[2]) != expected_by_sheet[sheet_name][row_number]:
+                    moved.add(sheet_name)
+                    break
+        return moved
+    
+    def _execute_batch(self, requests: List[Tuple[Any, Callable, Tuple[int, ...]]]):
+        """Send (request, callback, retry statuses) entries in batch requests of up to BATCH_LIMIT.
+        
+        A sub-request failing with one of its retry statuses is sent again in a
+        later batch, after the same backoff as _execute(); other errors, and
+        the last failure, go to its callback.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            retries = []
+            retry_afters = []
+            
+            def on_response(entry, request_id, response, exception):
+                request, callback, retry_statuses = entry
+                if (attempt < MAX_RETRIES and isinstance(exception, HttpError)
+                        and exception.resp.status in retry_statuses):
+                    retries.append(entry)
+                    retry_afters.append(exception.resp.get('retry-after'))
+                    return
+                callback(request_id, response, exception)
+            
+            for i in range(0, len(requests), BATCH_LIMIT):
+                entries = requests[i:i + BATCH_LIMIT]
+                batch = self.service.new_batch_http_request()
+                for entry in entries:
+                    batch.add(entry[0], callback=partial(on_response, entry))
+                # The batch as a whole is only retried on statuses all of its requests allow
+                _execute(batch, tuple(set(RETRY_STATUSES).intersection(*(entry[2] for entry in entries))))
+            
+            if not retries:
+                return
+            requests = retries
+            time.sleep(max(_retry_delay(attempt, retry_after) for retry_after in retry_afters))
+    
+    def _get_index(self, sheet_name: str,
+                   keys: Optional[List[int]] = None) -> Tuple[int, Dict[int, Tuple[int, bool]]]:
+        """Row count and {row key: (row number, categorized)} for a sheet.
+        
+        Comes from the local index when there is one (limited to keys, if
+        given); otherwise the sheet is read (or taken from prefetch()) and the
+        result indexed for next time.
+        """
+        prefetched = self._prefetched.pop(sheet_name, None)
+        local = self._load_index(sheet_name, keys)
+        if local is not None:
+            return local
+        
+        row_count, existing = prefetched or self.get_row_count_and_existing(sheet_name)
+        
+        # First sheet row for each key (rows start at 2, below the header)
+        index = {}
+        for i, row in enumerate(existing):
+            if len(row) >= 3:
+                categorized = len(row) > 4 and bool(row[4])
+                index.setdefault(_row_key(row[0], row[1], row[2]), (i + 2, categorized))
+        
+        if row_count:  # 0 means the read failed; don't index that
+            self._update_index(sheet_name, row_count, index, replace=True)
+        return row_count, index
+    
+    def _forget_missing_sheet(self, sheet_name: str, exception: Exception):
+        """Drop the local index of a sheet a write couldn't find (400), e.g. one deleted by hand.
+        
+        The index is what lets get_or_create_sheet() skip the metadata check,
+        so without it the next sync looks the sheet up again and recreates it.
+        """
+        if isinstance(exception, HttpError) and exception.resp.status == 400:
+            self._drop_index(sheet_name)
+    
+    def _index_appended(self, sheet_name: str, row_count: int, transactions: List[Dict[str, Any]],
+                        response: Dict[str, Any]):
+        """Add appended transactions to the local index, at the rows the append reported.
+        
+        A sheet without an index is left alone: indexing just the appended rows
+        would hide the rest of the sheet from dedup, so it's read in full next sync.
+        """
+        if not self._is_indexed(sheet_name):
+            return
+        
+        match = _UPDATED_RANGE_ROW_RE.search(response.get('updates', {}).get('updatedRange', ''))
+        if match is None:
+            # Without row numbers the index can't be kept accurate; rebuild it next sync
+            self._drop_index(sheet_name)
+            return
+        
+        first_row = int(match.group(1))
+        entries = {}
+        for i, tx in enumerate(transactions):
+            entries.setdefault(_tx_key(tx), (first_row + i, bool(tx.get('parent_category'))))
+        self._update_index(sheet_name, max(row_count, first_row + len(transactions) - 1), entries)
     
     def update_transaction_categories(self, sheet_name: str, transactions: List[Dict[str, Any]]):
         """Update existing transactions with category information."""
         if not transactions:
             return
         
-        # Get all existing data to find row numbers
         try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range=f"{sheet_name}!A:F"
-            ).execute()
-            
-            existing_data = result.get('values', [])
-            
-            # Find rows to update
-            updates = []
-            for tx in transactions:
-                for i, row in enumerate(existing_data):
-                    if (len(row) >= 3 and 
-                        row[0] == tx.get('date', '') and 
-                        row[1] == tx.get('description', '') and
-                        (len(row) < 5 or not row[4] or row[4] == '')):  # No category yet
-                        
-                        # Update the category columns (E and F)
-                        updates.append({
-                            'range': f"{sheet_name}!E{i+1}:F{i+1}",
-                            'values': [[tx.get('parent_category', ''), tx.get('category', '')]]
-                        })
-                        break
+            keys = list(map(_tx_key, transactions))
+            row_count, index = self._get_index(sheet_name, keys)
+            if self._moved_sheets([(sheet_name, self._expected_keys(index, transactions))]):
+                # The index is stale; rebuild it from the sheet
+                self._drop_index(sheet_name)
+                row_count, index = self._get_index(sheet_name, keys)
+            updates = self._find_category_rows(sheet_name, transactions, index)
             
             if updates:
-                # Batch update
-                body = {
-                    'valueInputOption': 'USER_ENTERED',
-                    'data': updates
-                }
-                
-                self.service.spreadsheets().values().batchUpdate(
-                    spreadsheetId=self.spreadsheet_id,
-                    body=body
-                ).execute()
+                _execute(self._category_update_request(self._category_update_data(sheet_name, updates)))
+                self._update_index(sheet_name, row_count, {
+                    key: (index[key][0], True) for key in map(_tx_key, transactions) if key in index
+                })
                 
                 print(f"✓ Updated {len(updates)} transactions with categories")
             
         except HttpError as e:
             print(f"❌ Error updating categories: {e}")
-
+    
+    def _find_category_rows(self, sheet_name: str, transactions: List[Dict[str, Any]],
+                            index: Optional[Dict[int, Tuple[int, bool]]] = None) -> Dict[int, List[str]]:
+        """Locate the uncategorized sheet rows for the given transactions.
+        
+        Row numbers come from the sheet's row index, so nothing is read back
+        from the sheet. Returns {row number: [category, subcategory]} for
+        every row found.
+        """
+        if index is None:
+            _, index = self._get_index(sheet_name)
+        
+        updates = {}
+        for tx in transactions:
+            existing_row = index.get(_tx_key(tx))
+            if existing_row is not None and not existing_row[1]:  # No category yet
+                updates[existing_row[0]] = [tx.get('parent_category', ''), tx.get('category', '')]
+        
+        return updates
+    
+    def _category_update_data(self, sheet_name: str, updates: Dict[int, List[str]]) -> List[Dict[str, Any]]:
+        """values.batchUpdate entries writing category columns for {row number: values}.
+        
+        Consecutive rows are merged into one E{first}:F{last} range, so a block
+        of newly categorized rows is a single entry rather than one per row.
+        """
+        range_template = sheet_name + '!E{}:F{}'
+        return [
+            {
+                'range': range_template.format(first, last),
+                'values': [updates[row_number] for row_number in range(first, last + 1)]
+            }
+            for first, last in _row_runs(updates)
+        ]
+    
+    def _category_update_request(self, data: List[Dict[str, Any]]):
+        """Build (without executing) the batch update writing category columns."""
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': data
+        }
+        
+        return self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body=body
+        )
 
 
 